@@ -1,67 +1,212 @@
 # yamcam CLI - CeC November 2024
 #
-# camera_audio_stream.py --> audio streaming class
+# camera_audio_stream.py --> audio streaming classes
 #
 #
-#  Class: CameraAudioStream - each sound source is analyzed in a separate thread
+#  Class: StreamMultiplexer - a single thread that waits on the FFMPEG stdout and
+#         stderr pipes of every sound source and dispatches whichever is readable
 #
 #  Methods:
 #
-#         __init__(self, camera_name, rtsp_url, analyze_callback)
-#             Set up thread
+#         __init__(self, shutdown_event)
+#             Set up the selector and thread
+#
+#         start(self) / join(self, timeout)
+#             Start / wait for the multiplexer thread
+#
+#         register(self, fd, callback) / unregister(self, fd)
+#             Add or remove a pipe fd; callback() is run when it is readable
+#
+#         add_deadline(self, callback, deadline) / cancel_deadline(self, callback)
+#             Run callback() on the multiplexer thread once time.monotonic() passes
+#             deadline (checked at least once a second), unless cancelled first
+#
+#         run(self)
+#             Select loop; exits when shutdown_event is set
+#
+#
+#  Class: CameraAudioStream - one FFMPEG process per sound source, its pipes
+#         serviced by the StreamMultiplexer
+#
+#  Methods:
+#
+#         __init__(self, camera_name, rtsp_url, analyze_callback, buffer_size,
+#                  shutdown_event, multiplexer)
+#             Set up stream state
 #
 #         start(self)
-#             Start thread - set up FFMPEG to stream with proper settings
+#             Set up FFMPEG to stream with proper settings, register its pipes and
+#             a startup deadline (stop if FFMPEG has not started within 30s)
 #
 #         stop(self)
-#             Stop thread
+#             Unregister pipes and stop FFMPEG
 #
 #         read_stream(self)
-#             Continuously pull data from FFMPEG stream.  When a 31,200 byte segment
-#             is in hand, convert to a form that YAMNet can classify.
-#             Pass the waveform to analyze_callback (in yamnet.py) which
-#             in turn calls rank_scores (in yamnet_functions.py) and returns
-#             results that can be sent (via the report function in yamnet_functions.py)
-#             to Home Assistant via MQTT.
-#             
+#             Called when FFMPEG stdout is readable. Pull available data straight into
+#             an int16 window array.  When a 31,200 byte segment is in hand, pass
+#             the raw PCM window to analyze_callback (in yamcam.py; the inference
+#             worker scales it into the YAMNet input tensor) and start a fresh window.
+#
 #         read_stderr(self)
-#             Monitor stderr for messages from FFMPEG which can be informational
-#             or errors, but FFMPEG does not provide a code to differentiate between them.
+#             Called when FFMPEG stderr is readable. Check messages from FFMPEG which
+#             can be informational or errors, but FFMPEG does not provide a code to
+#             differentiate between them.
+#
+#
+#  Class: PyAVAudioStream - (audio_backend: pyav) decode the RTSP feed in-process
+#         with PyAV (libavformat/libavcodec) instead of an FFMPEG subprocess, so
+#         there is no pipe and no int16->float32 conversion in Python
+#
+#  Methods:
+#
+#         __init__(self, camera_name, rtsp_url, analyze_callback, buffer_size,
+#                  shutdown_event)
+#             Set up stream state
+#
+#         start(self) / stop(self)
+#             Start / stop the decode thread
+#
+#         read_stream(self)
+#             Decode thread: open the feed, resample to 16 kHz mono float32 and
+#             pass each full window to analyze_callback (in yamcam.py)
 
 import threading
 import subprocess
+import selectors
 import time
 import logging
-import fcntl
 import os
+import re
 
 import numpy as np
 
+try:
+    import av  # only needed for audio_backend: pyav
+except ImportError:
+    av = None
+
 
 logger = logging.getLogger(__name__)
 
+STARTUP_TIMEOUT = 30  # seconds for FFmpeg to start delivering audio
+
+# FFmpeg stderr messages we act on; matched against the raw bytes in one pass
+_STDERR_RE = re.compile(
+    rb"Connection timed out|404 Not Found|Immediate exit requested|Press \[q\] to stop"
+)
+
+# FFmpeg ends its periodic progress/stats lines with \r, not \n
+_STDERR_LINE_END_RE = re.compile(rb"\r\n|[\r\n]")
+STDERR_PENDING_MAX = 4096  # bytes; a longer unterminated line is dropped
+
+#                                              #
+### ------ SINGLE THREAD FOR ALL PIPES ------###
+#                                              #
+
+class StreamMultiplexer:
+    def __init__(self, shutdown_event):
+        self.shutdown_event = shutdown_event
+        self.deadlines = {}  # {callback: time.monotonic() deadline}
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name="StreamMultiplexer")
+
+    def start(self):
+        self.thread.start()
+
+    def join(self, timeout=None):
+        if self.thread.is_alive() and self.thread != threading.current_thread():
+            self.thread.join(timeout=timeout)
+
+    def register(self, fd, callback):
+        with self.lock:
+            self.selector.register(fd, selectors.EVENT_READ, callback)
+
+    def unregister(self, fd):
+        with self.lock:
+            try:
+                self.selector.unregister(fd)
+            except (KeyError, ValueError):
+                pass  # never registered or already closed
+
+    def add_deadline(self, callback, deadline):
+        with self.lock:
+            self.deadlines[callback] = deadline
+
+    def cancel_deadline(self, callback):
+        with self.lock:
+            self.deadlines.pop(callback, None)
+
+    def _run_expired_deadlines(self):
+        now = time.monotonic()
+        with self.lock:
+            expired = [cb for cb, deadline in self.deadlines.items() if now >= deadline]
+            for cb in expired:
+                del self.deadlines[cb]
+        for cb in expired:
+            cb()
+
+    def run(self):
+        logger.debug("Stream multiplexer started.")
+        # Bind once; this loop wakes for every pipe read of every camera
+        select = self.selector.select
+        is_set = self.shutdown_event.is_set
+        while not is_set():
+            # Wake at least once a second so shutdown is noticed
+            events = select(timeout=1.0)
+            for key, _ in events:
+                if is_set():
+                    break
+                key.data()
+            if self.deadlines:
+                self._run_expired_deadlines()
+        with self.lock:
+            self.selector.close()
+        logger.debug("Stream multiplexer stopped.")
+
+
+#                                              #
+### ------ CLASS FOR ONE SOUND SOURCE -------###
+#                                              #
+
 class CameraAudioStream:
-    def __init__(self, camera_name, rtsp_url, analyze_callback, buffer_size, shutdown_event):
+    def __init__(self, camera_name, rtsp_url, analyze_callback, buffer_size,
+                 shutdown_event, multiplexer):
         self.camera_name = camera_name
         self.rtsp_url = rtsp_url
         self.analyze_callback = analyze_callback
         self.buffer_size = buffer_size
         self.shutdown_event = shutdown_event
+        self.multiplexer = multiplexer
         self.process = None
+        self._stdout_fd = None  # raw pipe fds, read directly with os.readv/os.read
+        self._stderr_fd = None
         self.command = []
-        self.read_thread = None
-        self.error_thread = None
-        self.timeout_thread = None
-        self.running = False
-        self.lock = threading.Lock()
-        self.ffmpeg_started_event = threading.Event() # flag for successful connection
+        self._started = False  # FFmpeg has started delivering (cancels the startup deadline)
+        self._running = threading.Event()  # set while the stream is up
+        self.lock = threading.Lock()       # serializes FFmpeg process setup/teardown
+        # Window being filled; FFmpeg output is read straight into it
+        self._window = None          # int16 samples, handed off whole once full
+        self._mv = None              # byte view of self._window for os.readv
+        self._new_window()
+        self._filled = 0             # bytes of the current window already read
+        self._stderr_pending = b""   # partial stderr line carried between reads
+
+    @property
+    def running(self):
+        return self._running.is_set()
+
+    def _new_window(self):
+        # A full window is queued for analysis, so each window gets its own array
+        self._window = np.empty(self.buffer_size // 2, dtype=np.int16)
+        self._mv = memoryview(self._window).cast('B')
 
     def start(self):
         with self.lock:
-            if self.running:
+            if self._running.is_set():
                 logger.warning(f"{self.camera_name}: Stream already running.")
                 return
-            self.running = True
+            self._running.set()
             logger.debug(f"START audio stream: {self.camera_name}.")
 
             # Prepare the FFmpeg command with the RTSP URL including the timeout parameter
@@ -73,6 +218,10 @@ class CameraAudioStream:
                 '-rtsp_transport', 'tcp',
                 '-i', rtsp_url_with_timeout,
                 '-vn',  # Disable video processing
+                # Resample to 16 kHz inside the filter graph so asetnsamples
+                # cuts frames of exactly one YAMNet window (15600 samples)
+                '-af', 'aresample=16000:async=1,asetnsamples=n=15600:p=0',
+                '-flush_packets', '1',  # write each window as soon as it is cut
                 '-f', 's16le',
                 '-acodec', 'pcm_s16le',
                 '-ac', '1',
@@ -81,36 +230,44 @@ class CameraAudioStream:
                 '-use_wallclock_as_timestamps', '1',
                 '-probesize', '50M',
                 '-analyzeduration', '10M',
-                '-max_delay', '500000',
+                '-max_delay', '50000',
                 '-flags', 'low_delay',
                 '-fflags', 'nobuffer',
                 '-'
             ]
 
-            logger.debug(f"{self.camera_name}: FFmpeg command: {' '.join(self.command)}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"{self.camera_name}: FFmpeg command: {' '.join(self.command)}")
 
-            # Start the FFmpeg process
+            # Start the FFmpeg process. Pipes are left unbuffered: the selector
+            # can only see bytes still in the kernel pipe, not ones sitting in
+            # a Python-side buffer. Its own session keeps a terminal ^C from
+            # reaching FFmpeg directly; stop() shuts it down.
             self.process = subprocess.Popen(
                 self.command,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
                 stdin=subprocess.DEVNULL,
-                bufsize=0
+                bufsize=0,
+                start_new_session=True
             )
 
-            # Set stdout and stderr to non-blocking mode
-            self._set_non_blocking(self.process.stdout)
-            self._set_non_blocking(self.process.stderr)
+            # Read the raw fds (no Python buffering layer) in non-blocking mode
+            self._stdout_fd = self.process.stdout.fileno()
+            self._stderr_fd = self.process.stderr.fileno()
+            os.set_blocking(self._stdout_fd, False)
+            os.set_blocking(self._stderr_fd, False)
 
-            # Start reading threads
-            self.read_thread = threading.Thread(target=self.read_stream, name=f"ReadThread-{self.camera_name}")
-            self.error_thread = threading.Thread(target=self.read_stderr, name=f"ErrorThread-{self.camera_name}")
-            self.read_thread.start()
-            self.error_thread.start()
+            # Hand both pipes to the multiplexer thread
+            self._filled = 0
+            self._stderr_pending = b""
+            self.multiplexer.register(self._stdout_fd, self.read_stream)
+            self.multiplexer.register(self._stderr_fd, self.read_stderr)
 
-            # Start the timeout monitor thread
-            self.timeout_thread = threading.Thread(target=self._timeout_monitor, name=f"TimeoutThread-{self.camera_name}")
-            self.timeout_thread.start()
+            # Give up if FFmpeg has not started within STARTUP_TIMEOUT
+            self._started = False
+            self.multiplexer.add_deadline(self._startup_timed_out,
+                                          time.monotonic() + STARTUP_TIMEOUT)
 
     def _construct_rtsp_url_with_timeout(self):
         if '?' in self.rtsp_url:
@@ -118,96 +275,108 @@ class CameraAudioStream:
         else:
             return f"{self.rtsp_url}?timeout=30000000"
 
-    def _set_non_blocking(self, fd):
-        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
-        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    def _startup_timed_out(self):
+        logger.warning(f"{self.camera_name}: FFmpeg process did not start within {STARTUP_TIMEOUT} seconds. Check your RTSP path.")
+        self.stop()
 
-    def _timeout_monitor(self):
-        timeout_duration = 30  # seconds
-        # Wait for ffmpeg_started_event to be set, with a timeout
-        if not self.ffmpeg_started_event.wait(timeout_duration):  # <-- Modified this block
-            # Timeout occurred
-            logger.warning(f"{self.camera_name}: FFmpeg process did not start within {timeout_duration} seconds. Check your RTSP path.")
-            self.stop()
-        else:
-            # FFmpeg started successfully
-            logger.debug(f"{self.camera_name}: FFmpeg process has started successfully.")
+    def _mark_started(self):
+        self._started = True
+        self.multiplexer.cancel_deadline(self._startup_timed_out)
+        logger.debug(f"{self.camera_name}: FFmpeg process has started successfully.")
 
     def read_stream(self):
-        raw_audio = b""
-        while self.running and not self.shutdown_event.is_set():
-            try:
-                chunk = self.process.stdout.read(self.buffer_size - len(raw_audio))
-                if chunk:
-                    raw_audio += chunk
-                    if len(raw_audio) >= self.buffer_size:
-                        # Convert raw PCM data to float32 array in the range [-1, 1]
-                        waveform = np.frombuffer(raw_audio, dtype=np.int16).astype(np.float32)
-                        waveform /= 32768.0  # Normalize to range [-1, 1]
-                        self.analyze_callback(waveform, self.camera_name)
-                        raw_audio = b""  # Reset buffer after processing
-                else:
-                    time.sleep(0.1)  # No data; wait briefly
-            except BlockingIOError:
-                time.sleep(0.1)  # No data available; wait briefly
-            except Exception as e:
-                logger.error(f"{self.camera_name}: Exception in read_stream: {e}", exc_info=True)
-                break
-        logger.debug(f"{self.camera_name}: Exiting read_stream.")
+        fd = self._stdout_fd
+        if fd is None or not self._running.is_set():
+            return
+        filled = self._filled
+        try:
+            # One read(2) straight into the window buffer
+            n = os.readv(fd, [self._mv[filled:]])
+            if n == 0:
+                logger.debug(f"{self.camera_name}: FFmpeg stdout closed.")
+                self.multiplexer.unregister(fd)
+                return
+            if not self._started:
+                self._mark_started()
+            filled += n
+            # FFmpeg writes whole windows, but a pipe does not preserve write
+            # boundaries, so a window can still arrive split across wakeups
+            if filled == self.buffer_size:
+                # Hand off the raw PCM; no copy or conversion on this thread
+                self.analyze_callback(self._window, self.camera_name)
+                self._new_window()
+                filled = 0
+            self._filled = filled
+        except BlockingIOError:
+            pass  # No data available; the selector will report the fd again
+        except Exception as e:
+            logger.error(f"{self.camera_name}: Exception in read_stream: {e}", exc_info=True)
+            self.multiplexer.unregister(fd)
 
     def read_stderr(self):
-        # Check if the FFmpeg process was created successfully
-        if not self.process or self.process.poll() is not None:
-            logger.error(f"{self.camera_name}: FFmpeg process failed to start or exited unexpectedly.")
-            return  # Exit early if the process didn't start or has already exited
-        while self.running and not self.shutdown_event.is_set():
-            try:
-                # Ensure stderr is still available
-                if self.process.stderr:
-                    line = self.process.stderr.readline()
-                    if line:
-                        self._handle_stderr_line(line)
-                    else:
-                        time.sleep(0.1)  # Brief wait to avoid tight loop if no data
-                else:
-                    logger.warning(f"{self.camera_name}: FFmpeg stderr is not available.")
-                    break  # Exit if stderr becomes unavailable
-            except (OSError, BlockingIOError):
-                time.sleep(0.1)  # No data available; wait briefly
-            except Exception as e:
-                logger.error(f"{self.camera_name}: Exception in read_stderr: {e}", exc_info=True)
-                break
-        logger.debug(f"{self.camera_name}: Exiting read_stderr.")
-
-
-        
+        fd = self._stderr_fd
+        if fd is None or not self._running.is_set():
+            return
+        try:
+            data = os.read(fd, 65536)
+            if not data:
+                logger.debug(f"{self.camera_name}: FFmpeg stderr closed.")
+                self.multiplexer.unregister(fd)
+                return
+            *lines, pending = _STDERR_LINE_END_RE.split(self._stderr_pending + data)
+            # Never let an unterminated line grow without bound
+            self._stderr_pending = pending if len(pending) <= STDERR_PENDING_MAX else b""
+            for line in lines:
+                if line:
+                    self._handle_stderr_line(line)
+        except BlockingIOError:
+            pass  # No data available; the selector will report the fd again
+        except Exception as e:
+            logger.error(f"{self.camera_name}: Exception in read_stderr: {e}", exc_info=True)
+            self.multiplexer.unregister(fd)
+
+
+
     def _handle_stderr_line(self, line):
-        line_decoded = line.decode('utf-8', errors='ignore').strip()
-        logger.debug(f"FFmpeg stderr ({self.camera_name}): {line_decoded}")
+        # Decoding and formatting every FFmpeg line is wasted work unless DEBUG is on
+        if logger.isEnabledFor(logging.DEBUG):
+            line_decoded = line.decode('utf-8', errors='ignore').strip()
+            logger.debug(f"FFmpeg stderr ({self.camera_name}): {line_decoded}")
 
-        if "Connection timed out" in line_decoded:
+        match = _STDERR_RE.search(line)
+        if match is None:
+            return
+        message = match.group(0)
+        if message == b"Connection timed out":
             logger.warning(f"{self.camera_name}: Connection timed out.")
             self.stop()
-        elif "404 Not Found" in line_decoded:
+        elif message == b"404 Not Found":
             logger.warning(f"{self.camera_name}: Stream not found (404).")
             self.stop()
-        elif "Immediate exit requested" in line_decoded:
+        elif message == b"Immediate exit requested":
             logger.debug(f"{self.camera_name}: Immediate exit requested.")
             self.stop()
         # detected successful initiation of ffmpeg stream
-        elif "Press [q] to stop" in line_decoded:  # <-- Added this condition
-            logger.debug(f"{self.camera_name}: FFmpeg process has started successfully.")
-            self.ffmpeg_started_event.set()  # <-- Added this line
+        elif not self._started:  # "Press [q] to stop"
+            self._mark_started()
 
 
     def stop(self):
+        if not self._running.is_set():
+            return  # already stopped; no need to take the lock
         with self.lock:
-            if not self.running:
-                return
-            self.running = False
+            if not self._running.is_set():
+                return  # stopped by another thread while we waited
+            self._running.clear()
             self.shutdown_event.set()
             logger.debug(f"{self.camera_name}: Stopping audio stream.")
+            self.multiplexer.cancel_deadline(self._startup_timed_out)
             if self.process:
+                # Stop servicing the pipes before they are closed
+                self.multiplexer.unregister(self._stdout_fd)
+                self.multiplexer.unregister(self._stderr_fd)
+                self._stdout_fd = None
+                self._stderr_fd = None
                 try:
                     self.process.terminate()
                     try:
@@ -225,12 +394,93 @@ class CameraAudioStream:
                     if self.process.stderr:
                         self.process.stderr.close()
                     self.process = None
-            # Wait for threads to finish
-            current_thread = threading.current_thread()  # <-- Added this line
-            if self.read_thread and self.read_thread.is_alive() and self.read_thread != current_thread:
+            logger.debug(f"{self.camera_name}: Audio stream stopped.")
+
+
+#                                              #
+### ------ IN-PROCESS DECODE WITH PyAV ------###
+#                                              #
+
+class PyAVAudioStream:
+    def __init__(self, camera_name, rtsp_url, analyze_callback, buffer_size, shutdown_event):
+        if av is None:
+            raise RuntimeError("audio_backend 'pyav' needs PyAV (pip install av)")
+        self.camera_name = camera_name
+        self.rtsp_url = rtsp_url
+        self.analyze_callback = analyze_callback
+        self.window_samples = buffer_size // 2  # buffer_size is in s16le bytes
+        self.shutdown_event = shutdown_event
+        self.read_thread = None
+        self._running = threading.Event()  # set while the stream is up
+        self.lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._running.is_set()
+
+    def start(self):
+        with self.lock:
+            if self._running.is_set():
+                logger.warning(f"{self.camera_name}: Stream already running.")
+                return
+            self._running.set()
+            logger.debug(f"START audio stream (PyAV): {self.camera_name}.")
+            self.read_thread = threading.Thread(target=self.read_stream, name=f"ReadThread-{self.camera_name}")
+            self.read_thread.start()
+
+    def read_stream(self):
+        timeout_duration = 30  # seconds
+        try:
+            # (open timeout, read timeout) so a dead feed can't block stop() for long
+            container = av.open(self.rtsp_url,
+                                container_options={'rtsp_transport': 'tcp'},
+                                timeout=(timeout_duration, 5))
+        except Exception as e:
+            logger.warning(f"{self.camera_name}: Could not open stream within "
+                           f"{timeout_duration} seconds ({e}). Check your RTSP path.")
+            self.stop()
+            return
+
+        logger.debug(f"{self.camera_name}: PyAV stream opened.")
+        resampler = av.AudioResampler(format='flt', layout='mono', rate=16000)
+        window = np.empty(self.window_samples, dtype=np.float32)
+        filled = 0
+        try:
+            for frame in container.decode(audio=0):
+                if not self._running.is_set() or self.shutdown_event.is_set():
+                    break
+                for out_frame in resampler.resample(frame):
+                    samples = out_frame.to_ndarray().reshape(-1)
+                    pos = 0
+                    while pos < samples.size:
+                        take = min(self.window_samples - filled, samples.size - pos)
+                        window[filled:filled + take] = samples[pos:pos + take]
+                        filled += take
+                        pos += take
+                        if filled == self.window_samples:
+                            self.analyze_callback(window, self.camera_name)
+                            window = np.empty(self.window_samples, dtype=np.float32)
+                            filled = 0
+        except Exception as e:
+            if self._running.is_set():
+                logger.warning(f"{self.camera_name}: PyAV stream ended: {e}")
+        finally:
+            container.close()
+        # Feed ended: mark the stream down so the supervisor can restart it
+        self._running.clear()
+        logger.debug(f"{self.camera_name}: Exiting read_stream.")
+
+    def stop(self):
+        if not self._running.is_set():
+            return  # already stopped; no need to take the lock
+        with self.lock:
+            if not self._running.is_set():
+                return  # stopped by another thread while we waited
+            self._running.clear()
+            self.shutdown_event.set()
+            logger.debug(f"{self.camera_name}: Stopping audio stream.")
+            # The decode thread notices within one frame or the 5s read timeout
+            if (self.read_thread and self.read_thread.is_alive()
+                    and self.read_thread != threading.current_thread()):
                 self.read_thread.join(timeout=5)
-            if self.error_thread and self.error_thread.is_alive() and self.error_thread != current_thread:
-                self.error_thread.join(timeout=5)
-            if self.timeout_thread and self.timeout_thread.is_alive() and self.timeout_thread != current_thread:
-                self.timeout_thread.join(timeout=5)
             logger.debug(f"{self.camera_name}: Audio stream stopped.")
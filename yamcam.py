@@ -5,6 +5,7 @@
 #
 import time
 import threading 
+import queue
 import logging
 import signal
 import sys
@@ -18,11 +19,12 @@ from yamcam_functions import (
 import yamcam_config  # all setup and config happens here
 from yamcam_config import logger
 from yamcam_supervisor import CameraStreamSupervisor  # Import the supervisor
-from yamcam_config import interpreter, input_details, output_details
+from yamcam_config import inference_workers, interpreters
 
-# Not using at the moment...but handy to resurrect for any thorny bugs in future
-# Enable faulthandler to dump tracebacks
-faulthandler.enable()
+# Handy for thorny bugs: at DEBUG level, 'kill -USR1 <pid>' dumps the
+# stack of every thread to stderr (no overhead unless the signal arrives)
+if yamcam_config.log_level == 'DEBUG':
+    faulthandler.register(signal.SIGUSR1, all_threads=True)
 
 def dump_all_thread_traces():
     for thread in threading.enumerate():
@@ -36,6 +38,7 @@ def dump_all_thread_traces():
 
 # -------- PULL FROM CONFIG FILE
 camera_settings = yamcam_config.camera_settings
+sounds_to_track = yamcam_config.sounds_to_track  # frozenset of group names
 
 # -------- GLOBALS
 running = True
@@ -60,37 +63,98 @@ signal.signal(signal.SIGTERM, shutdown)
 ### ---------- SOUND ANALYSIS HUB -------------###
 #                                                #
 
+# Waveforms waiting for an inference worker: (waveform, camera_name, queued_at).
+# Each worker has its own queue and every camera is assigned to one worker
+# (round-robin, the first time it is seen), so a camera's windows are analyzed
+# one at a time and in order - the event window in update_sound_window counts
+# on that.
+work_queues = [queue.SimpleQueue() for _ in range(inference_workers)]
+camera_queues = {}               # {camera_name: work queue of its worker}
+camera_queues_lock = threading.Lock()
+
+def work_queue_for(camera_name):
+    work_queue = camera_queues.get(camera_name)
+    if work_queue is None:
+        with camera_queues_lock:
+            if camera_name not in camera_queues:
+                camera_queues[camera_name] = work_queues[len(camera_queues) % len(work_queues)]
+            work_queue = camera_queues[camera_name]
+    return work_queue
+
+# A window that has waited longer than this for a worker is dropped: a newer
+# window from the same camera is already on its way, so analyzing the old one
+# only makes detection lag further behind real time (and the queue grow).
+STALE_WINDOW_SECONDS = 0.9
+EWMA_ALPHA = 0.1
+analysis_ewma = {}      # {camera_name: smoothed seconds per analysis}
+lagging_cameras = set() # cameras currently having windows dropped
+
+# Called for each full window on the stream multiplexer (or PyAV decode)
+# thread, so it only queues the work.
 def analyze_callback(waveform, camera_name):
-    try:
-        if shutdown_event.is_set():
-            return
+    work_queue_for(camera_name).put((waveform, camera_name, time.monotonic()))
+
 
-        # Use the shared interpreter, input, and output details from yamcam_config
-        scores = analyze_audio_waveform(waveform, camera_name, interpreter, input_details, output_details)
+# One worker per interpreter; each invoke() runs on the worker's own
+# interpreter, so cameras are analyzed in parallel
+def inference_worker(work_queue, interpreter):
+    while not shutdown_event.is_set():
+        try:
+            waveform, camera_name, queued_at = work_queue.get(timeout=1.0)
+        except queue.Empty:
+            continue
 
+        # The one shutdown check per window: analysis, ranking and the event
+        # window below all assume shutdown was not requested when it started
         if shutdown_event.is_set():
-            return
+            break
+
+        t0 = time.monotonic()
+        if t0 - queued_at > STALE_WINDOW_SECONDS:
+            if camera_name not in lagging_cameras:
+                lagging_cameras.add(camera_name)
+                logger.warning(f"{camera_name}: Analysis can't keep up "
+                               f"({analysis_ewma.get(camera_name, 0.0):.3f}s per window); "
+                               f"dropping stale audio windows.")
+            continue
+        if camera_name in lagging_cameras:
+            lagging_cameras.discard(camera_name)
+            logger.info(f"{camera_name}: Analysis caught up; no longer dropping windows.")
+
+        scores = analyze_audio_waveform(waveform, camera_name, interpreter)
+        handle_scores(scores, camera_name)
+
+        dt = time.monotonic() - t0
+        ewma = analysis_ewma.get(camera_name, dt)
+        analysis_ewma[camera_name] = ewma + EWMA_ALPHA * (dt - ewma)
+
+
+def handle_scores(scores, camera_name):
+    try:
         if scores is not None:
             results = rank_sounds(scores, camera_name)
-            if shutdown_event.is_set():
-                return
             detected_sounds = [
                 result['class']
                 for result in results
-                if result['class'] in yamcam_config.sounds_to_track
+                if result['class'] in sounds_to_track
             ]
             update_sound_window(camera_name, detected_sounds)
         else:
             if not shutdown_event.is_set():
                 logger.error(f"FAILED to analyze audio: {camera_name}")
     except Exception as e:
-        logger.error(f"Exception in analyze_callback for {camera_name}: {e}", exc_info=True)
+        logger.error(f"Exception in handle_scores for {camera_name}: {e}", exc_info=True)
 
 
 #                                                #
 ### ---------- START STREAMS ------------------###
 #                                                #
 
+# Start the inference workers before any audio arrives
+for i, (work_queue, worker_interpreter) in enumerate(zip(work_queues, interpreters)):
+    threading.Thread(target=inference_worker, args=(work_queue, worker_interpreter),
+                     name=f"InferenceWorker-{i}").start()
+
 # Create and start streams using the supervisor
 supervisor = CameraStreamSupervisor(camera_settings, analyze_callback, shutdown_event)
 supervisor.start_all_streams()
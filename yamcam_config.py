@@ -7,6 +7,7 @@
 import yaml
 import csv
 import logging
+import numpy as np
 import tensorflow as tf
 import time
 import threading
@@ -18,7 +19,9 @@ from datetime import datetime
 
 config_path = './microphones.yaml'
 class_map_path = './files/yamnet_class_map.csv'
+class_map_cache_path = './files/yamnet_class_map.npy'  # parsed class_map_path
 model_path = './files/yamnet.tflite'
+quantized_model_path = './files/yamnet_int8.tflite'  # made by yamnet_quantize.py
 log_dir = './logs'
 sound_log_dir = './logs'
 
@@ -153,6 +156,10 @@ logfile              = general_settings.get('logfile', False)
 sound_log            = general_settings.get('sound_log', False)
 log_everything       = general_settings.get('log_everything', False)
 ffmpeg_debug         = general_settings.get('ffmpeg_debug', False)
+model_quantized      = general_settings.get('model_quantized', False)
+audio_backend        = str(general_settings.get('audio_backend', 'ffmpeg')).lower()
+inference_workers    = general_settings.get('inference_workers', 4)
+interpreter_threads  = general_settings.get('interpreter_threads', 1)
 default_min_score    = general_settings.get('default_min_score', 0.5)
 noise_threshold      = general_settings.get('noise_threshold', 0.1)   
 top_k                = general_settings.get('top_k', 10)
@@ -163,7 +170,29 @@ logfile = validate_boolean("logfile", logfile)
 sound_log = validate_boolean("sound_log", sound_log)
 ffmpeg_debug = validate_boolean("ffmpeg_debug", ffmpeg_debug)
 log_everything = validate_boolean("log_everything", log_everything)
+model_quantized = validate_boolean("model_quantized", model_quantized)
 
+# AUDIO_BACKEND is an FFmpeg subprocess per camera or in-process PyAV
+if audio_backend not in ('ffmpeg', 'pyav'):
+    logger.warning(f"Invalid audio_backend '{audio_backend}'. "
+                    "Should be ffmpeg or pyav. Defaulting to ffmpeg."
+    )
+    audio_backend = 'ffmpeg'
+
+# INFERENCE_WORKERS must be between 1 and 4 (past 4 cores, big.LITTLE boards
+# start handing work to slow cores that hold everything up)
+if not (isinstance(inference_workers, int) and 1 <= inference_workers <= 4):
+    logger.warning(f"Invalid inference_workers '{inference_workers}'. "
+                    "Should be between 1 and 4. Defaulting to 4."
+    )
+    inference_workers = 4
+
+# INTERPRETER_THREADS (XNNPACK threads per interpreter) also between 1 and 4
+if not (isinstance(interpreter_threads, int) and 1 <= interpreter_threads <= 4):
+    logger.warning(f"Invalid interpreter_threads '{interpreter_threads}'. "
+                    "Should be between 1 and 4. Defaulting to 1."
+    )
+    interpreter_threads = 1
 
 
 # DEFAULT_MIN_SCORE must be between 0 and 1
@@ -233,7 +262,8 @@ except KeyError:
     logger.warning("Missing sounds settings in the configuration file. Using default values.")
     sounds = {} # in case none are configured.
 
-sounds_to_track = sounds.get('track', [])
+# frozenset: checked for every class/group on every frame, never changes
+sounds_to_track = frozenset(sounds.get('track') or [])
 sounds_filters = sounds.get('filters', {})
 
 # min_score values also need to be between 0 and 1
@@ -283,22 +313,97 @@ else:
 #                                              #
 
 # -------- LOAD MODEL (using TensorFLow Lite)
-
-logger.debug("Loading YAMNet model")
-interpreter    = tf.lite.Interpreter(model_path=model_path)
-interpreter.allocate_tensors()
-input_details  = interpreter.get_input_details()
-output_details = interpreter.get_output_details()
+# TFLite applies its XNNPACK CPU delegate to float models by default.
+
+if model_quantized:
+    if not os.path.exists(quantized_model_path):
+        logger.error(f"model_quantized is set but {quantized_model_path} does not exist. "
+                      "Create it with yamnet_quantize.py or set model_quantized to false.")
+        sys.exit(1)
+    model_path = quantized_model_path
+
+# One interpreter per inference worker (see yamcam.py), each using
+# interpreter_threads threads (1 by default). TFLite interpreters are not safe
+# to share between threads, so rather than serialize every camera through one,
+# each worker owns its own and cameras are analyzed in parallel.
+# Windows can't be batched into one invoke() instead: this YAMNet graph takes a
+# single 1-D [15600] waveform with no batch dimension. Resizing the input to
+# [N, 15600] fails in the XNNPACK delegate, and resizing it to [N * 15600] just
+# yields one [1, 521] score row averaged over all N windows.
+
+# No point in more interpreters than cameras or cores
+inference_workers = min(inference_workers, len(camera_settings), os.cpu_count() or 1)
+logger.debug(f"Loading YAMNet model {model_path} ({inference_workers} interpreters, "
+             f"{interpreter_threads} threads each)")
+interpreters = []
+for _ in range(inference_workers):
+    _interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=interpreter_threads)
+    _interpreter.allocate_tensors()
+    interpreters.append(_interpreter)
+del _interpreter
+input_details  = interpreters[0].get_input_details()    # same for every interpreter
+output_details = interpreters[0].get_output_details()
+
+# Tensor indices and window length never change; bind them once
+INPUT_IDX     = input_details[0]['index']
+OUTPUT_IDX    = output_details[0]['index']
+INPUT_SAMPLES = int(input_details[0]['shape'][-1])   # 15600 (0.975s at 16 kHz)
+
+# (scale, zero_point) used to move between float and int8 for the quantized model
+input_quantization  = input_details[0]['quantization']
+output_quantization = output_details[0]['quantization']
 logger.debug("YAMNet model loaded.")
 logger.debug(format_input_details(input_details))
 
 
 # -------- BUILD CLASS NAMES DICTIONARY
 
-class_names = []
-with open(class_map_path, 'r') as file:
-    reader = csv.reader(file)
-    next(reader)  # Skip the header
-    for row in reader:
-        class_names.append(row[2].strip('"'))
-
+# Parsing the CSV is only needed once; later startups load the cached
+# array (rebuilt whenever the CSV is newer than the cache, or unreadable)
+class_names = None
+if (os.path.exists(class_map_cache_path) and
+        os.path.getmtime(class_map_cache_path) >= os.path.getmtime(class_map_path)):
+    try:
+        class_names = np.load(class_map_cache_path).tolist()
+    except (OSError, ValueError, EOFError) as e:
+        logger.warning(f"Ignoring unreadable {class_map_cache_path} ({e}); rebuilding it.")
+
+if class_names is None:
+    class_names = []
+    with open(class_map_path, 'r') as file:
+        reader = csv.reader(file)
+        next(reader)  # Skip the header
+        for row in reader:
+            class_names.append(row[2].strip('"'))
+    # Write to a temp file and rename it over the cache, so an interrupted
+    # write never leaves a truncated cache behind
+    cache_tmp_path = f"{class_map_cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(cache_tmp_path, 'wb') as cache_file:
+            np.save(cache_file, np.array(class_names))
+        os.replace(cache_tmp_path, class_map_cache_path)
+    except OSError as e:
+        logger.debug(f"Could not cache class names in {class_map_cache_path}: {e}")
+        try:
+            os.remove(cache_tmp_path)
+        except OSError:
+            pass
+
+
+# -------- NUMBER THE SOUND GROUPS
+
+# Each class name starts with its group ('music.Guitar'); number the groups once
+# so that per-window scoring works on arrays indexed by group id, not strings
+class_group_name = [name.split('.', 1)[0] for name in class_names]
+group_names = sorted(set(class_group_name))
+group_to_id = {group: i for i, group in enumerate(group_names)}
+class_group_id = np.fromiter((group_to_id[group] for group in class_group_name),
+                             dtype=np.int32, count=len(class_group_name))
+num_groups = len(group_names)
+tracked_mask = np.array([group in sounds_to_track for group in class_group_name], dtype=bool)
+
+# Per group id: is the group tracked, and the min_score its composite score
+# must reach (so the final selection needs no per-group dict lookups)
+tracked_group_mask = np.array([group in sounds_to_track for group in group_names], dtype=bool)
+group_min_score = np.array([sounds_filters.get(group, {}).get('min_score', default_min_score)
+                            for group in group_names], dtype=np.float64)
@@ -6,10 +6,13 @@
 #
 #  ### Analyse the waveform using YAMNet
 #
-#         analyze_audio_waveform(waveform, camera_name, interpreter, input_details, output_details)
-#             Check waveform for compatibility with YAMNet interpreter, invoke the
-#             intepreter, and return scores (a [1,521] array of scores, ordered per the
-#             YAMNet class map CSV (files/yamnet_class_map.csv)
+#         analyze_audio_waveform(waveform, camera_name, interpreter)
+#             Check waveform for compatibility with YAMNet interpreter (either int16
+#             PCM samples, which are scaled to [-1, 1] on the way in, or floats), write
+#             it directly into the interpreter's input tensor, invoke the intepreter,
+#             and return scores (a [1,521] array of scores, ordered per the YAMNet
+#             class map CSV (files/yamnet_class_map.csv). The interpreter must be
+#             owned by the calling thread (see inference_worker in yamcam.py).
 #
 #  ### Ranking and Scoring Sounds
 #
@@ -21,11 +24,12 @@
 #             groups. A modified yamnet_class_map.csv prepends each Yamnet display name
 #             with a group name (people, music, birds, etc.) for this purpose.
 #
-#         group_scores_by_prefix(filtered_scores, class_names)
+#         group_scores_by_prefix(scores_row, kept_idx)
 #             Organize filtered scores into groups according to the prefix of each class
-#             name in (modified) files/yamnet_class_map.csv
+#             name in (modified) files/yamnet_class_map.csv, returning per-group arrays
+#             (indexed by group id, see yamcam_config) of class counts and max scores
 #
-#         calculate_composite_scores(group_scores_dict)
+#         calculate_composite_scores(count_per_group, max_per_group)
 #             To report by group (vs. individual classes), take the individual scores from
 #             each group (within the filtered scores) and use a simple algorithm to
 #             score the group.  If any individual class score within the group is above 0.7,
@@ -45,8 +49,19 @@
 #
 # ###  Misc
 #
+#          log_sound_rows(rows)
+#             Queue a list of rows (e.g., all the classes from one waveform) for the
+#             sound_log CSV file (never blocks the caller; if the writer falls behind,
+#             rows are dropped with one warning, and the total is logged once the
+#             writer catches up - see report_sound_log_caught_up())
+#
+#          write_sound_log()
+#             Sound log writer thread: write queued rows in batches, flushing every
+#             CSV_FLUSH_INTERVAL seconds rather than per row
+#
 #          close_sound_log_file()
-#             Make sure the sound_log CSV file is closed at exit
+#             Write any rows still queued and make sure the sound_log CSV file is
+#             closed at exit
 #
 # yamcam_functions.py - Functions for yamcam3
 #
@@ -56,24 +71,29 @@ import time
 import os
 import atexit
 import csv
+import queue
+import logging
 from datetime import datetime
-from threading import Lock
-from collections import deque
+from threading import Lock, Thread
 import numpy as np
 import json
 import yamcam_config
 from yamcam_config import (
-        interpreter, input_details, output_details, logger,
+        input_details, output_details, INPUT_IDX, OUTPUT_IDX, INPUT_SAMPLES,
+        logger,
         sound_log, sound_log_dir, shutdown_event
 )
 
 logger = yamcam_config.logger
 
-#                                                #
-### ---------- LOCKS for SAFE Threads -----------#
-#                                                #
-sound_log_lock = Lock()             # lock the shared log file when writing 
-interpreter_lock = Lock() # lock the shared interpreter when in use
+# Scale factor for s16le PCM -> float32 in [-1, 1]; kept as float32 so the
+# multiply never promotes to a float64 intermediate
+_INT16_RECIP = np.float32(1.0 / 32768.0)
+
+# A full-int8 model takes and returns quantized values; float and
+# dynamic-range (int8 weights only) models take and return float32
+_int8_input  = input_details[0]['dtype'] == np.int8
+_int8_output = output_details[0]['dtype'] == np.int8
 
 #                                                #
 ### ---------- SOUND LOG CSV SETUP --------------###
@@ -97,11 +117,8 @@ if sound_log:
         metadata = ["#", yamcam_config.window_detect,
                     yamcam_config.persistence,
                     yamcam_config.decay]
-        with sound_log_lock:
-            sound_log_writer.writerow(header)
-            sound_log_writer.writerow(metadata_key)
-            sound_log_writer.writerow(metadata)
-            sound_log_file.flush()
+        sound_log_writer.writerows([header, metadata_key, metadata])
+        sound_log_file.flush()
 
     except Exception as e:
         logger.warning(f"Could not create {sound_log_path}: {e}")
@@ -113,9 +130,88 @@ else:
 
 
 
+     # -------- BACKGROUND CSV WRITER
+     # Rows are queued by the inference workers and written by one thread, so
+     # analysis never waits on the file (or on another camera writing to it).
+     # Each queue entry is a list of rows, one list per waveform or event.
+
+CSV_FLUSH_INTERVAL = 0.5     # seconds between writes of queued rows
+CSV_BATCH_ROWS = 256         # ...or sooner, once this many rows are waiting
+sound_log_queue = queue.Queue(maxsize=10000)
+_CSV_STOP = object()         # queued by close_sound_log_file to end the writer
+
+# Rows dropped while the queue was full; nonzero means we're dropping (and have
+# warned once), until the writer empties the queue and reports the total
+sound_log_dropped = 0
+sound_log_dropped_lock = Lock()
+
+def log_sound_rows(rows):
+    global sound_log_dropped
+    try:
+        sound_log_queue.put_nowait(rows)
+    except queue.Full:
+        with sound_log_dropped_lock:
+            if sound_log_dropped == 0:
+                logger.warning("Sound log writer is falling behind; dropping CSV rows.")
+            sound_log_dropped += len(rows)
+
+def report_sound_log_caught_up():
+    global sound_log_dropped
+    with sound_log_dropped_lock:
+        if sound_log_dropped:
+            logger.info(f"Sound log writer caught up; {sound_log_dropped} CSV rows were dropped.")
+            sound_log_dropped = 0
+
+def write_sound_log():
+    rows = []
+    next_flush = time.monotonic() + CSV_FLUSH_INTERVAL
+    while True:
+        try:
+            batch = sound_log_queue.get(timeout=max(0.0, next_flush - time.monotonic()))
+        except queue.Empty:
+            batch = None
+        if batch is _CSV_STOP:
+            break
+        if batch is not None:
+            rows.extend(batch)
+        if len(rows) >= CSV_BATCH_ROWS or time.monotonic() >= next_flush:
+            if rows:
+                try:
+                    sound_log_writer.writerows(rows)
+                    sound_log_file.flush()
+                except Exception as e:
+                    logger.error(f"Error writing to CSV: {e}", exc_info=True)
+                rows = []
+            if sound_log_dropped and sound_log_queue.empty():
+                report_sound_log_caught_up()
+            next_flush = time.monotonic() + CSV_FLUSH_INTERVAL
+
+    # Drain whatever was queued before the stop marker
+    if rows:
+        try:
+            sound_log_writer.writerows(rows)
+        except Exception as e:
+            logger.error(f"Error writing to CSV: {e}", exc_info=True)
+
+if sound_log_writer is not None:
+    sound_log_thread = Thread(target=write_sound_log, name="SoundLogWriter", daemon=True)
+    sound_log_thread.start()
+else:
+    sound_log_thread = None
+
      # -------- MAKE SURE WE CLOSE CSV AT EXIT
 
 def close_sound_log_file():
+    if sound_log_thread is not None:
+        # If the writer is stuck (e.g., a stalled disk) the queue may stay full;
+        # give up after a few seconds rather than hang shutdown. The writer is
+        # a daemon thread, so it won't keep the process alive.
+        try:
+            sound_log_queue.put(_CSV_STOP, timeout=5)
+            sound_log_thread.join(timeout=5)
+        except queue.Full:
+            logger.warning("Sound log writer is not responding; closing the CSV "
+                           "file without writing the rows still queued.")
     if sound_log_file is not None:
         sound_log_file.close()
         logger.debug("Sound log file closed.")
@@ -129,18 +225,25 @@ atexit.register(close_sound_log_file)
      # -------- GLOBALS FOR SUMMARY REPORTING
 sound_event_tracker = {}
 sound_event_lock = Lock()
-event_counts = {}
 
      # -------- DATA STRUCTS FOR EVENTS
-# Decay counter data structure for detecting sound event termination
-# Stores decay counters for each active sound class per camera
-decay_counters = {}  # Structure: {camera_name: {sound_class: remaining_chunks}}
-
-# State management for sound event detection
-sound_windows = {}        # {camera_name: {sound_class: deque}}
-active_sounds = {}        # {camera_name: {sound_class: bool}}
-last_detection_time = {}  # {camera_name: {sound_class: timestamp}}
-
+# Event detection state for one tracked sound class on one camera
+class SoundState:
+    __slots__ = ('window', 'active', 'decay', 'last_time', 'event_count')
+
+    def __init__(self):
+        self.window = 0         # sliding window as bits: bit i set = detected i waveforms ago
+        self.active = False     # is a sound event in progress
+        self.decay = 0          # waveforms without the sound left before the event ends
+        self.last_time = None   # timestamp of the last detection
+        self.event_count = 0    # number of events started (for summary reporting)
+
+sound_state = {}          # {camera_name: {sound_class: SoundState}}
+
+# Each camera's state is only touched under that camera's lock, so cameras
+# being analyzed on different workers never wait on each other. state_lock
+# is only taken the first time a camera is seen, to create its state.
+camera_locks = {}         # {camera_name: Lock}
 state_lock = Lock()
 
 
@@ -155,40 +258,61 @@ def report_event(camera_name, sound_class, event_type, timestamp):
         else:                       # column 8 is end
             row = [log_timestamp, camera_name, '', '', '', '', '', sound_class]
 
-        try:
-            with sound_log_lock:
-                sound_log_writer.writerow(row)
-                sound_log_file.flush()
-        except Exception as e:
-            logger.error(f"Error writing to CSV: {e}", exc_info=True)
+        log_sound_rows([row])
 
 #                                                #
 ### ---------- SOUND FUNCTIONS ----------------###
 #                                                #
 
      # -------- ANALYZE Waveform using YAMNet  
-def analyze_audio_waveform(waveform, camera_name, interpreter, input_details, output_details):
-
-    if shutdown_event.is_set():
-        return None
+     # Each inference worker owns its interpreter, so no lock is needed here.
+def analyze_audio_waveform(waveform, camera_name, interpreter):
 
     try:
-        # Ensure waveform is a 1D array of float32 values between -1 and 1
-        waveform = np.squeeze(waveform).astype(np.float32)
+        # Ensure waveform is a 1D array of the length YAMNet takes. Windows from
+        # the streams already are, so they are used as-is (no squeeze, no copy).
         if waveform.ndim != 1:
-            logger.error(f"{camera_name}: Waveform must be a 1D array.")
+            waveform = np.squeeze(waveform)
+            if waveform.ndim != 1:
+                logger.error(f"{camera_name}: Waveform must be a 1D array.")
+                return None
+        if waveform.shape[0] != INPUT_SAMPLES:
+            logger.error(f"{camera_name}: Waveform has {waveform.shape[0]} samples; "
+                         f"YAMNet expects {INPUT_SAMPLES}.")
             return None
 
         # Invoke the YAMNET inference engine 
         try:
-            # Lock the shared interpreter
-            with interpreter_lock:
-                # Set input tensor and invoke interpreter
-                interpreter.set_tensor(input_details[0]['index'], waveform)
-                interpreter.invoke()
+            # Write the input straight into the interpreter's own input buffer.
+            # TFLite refuses to invoke() while a view of its buffers is alive,
+            # so the view is dropped before invoking.
+            input_view = interpreter.tensor(INPUT_IDX)()
+            if _int8_input:
+                # Quantize in a single float32 scratch array: scale (folding in
+                # the int16 -> [-1, 1] step), shift, round and clip in place
+                scale, zero_point = yamcam_config.input_quantization
+                step = _INT16_RECIP if waveform.dtype == np.int16 else np.float32(1.0)
+                q = np.multiply(waveform, step / np.float32(scale), dtype=np.float32)
+                q += zero_point
+                np.rint(q, out=q)
+                np.clip(q, -128, 127, out=q)
+                np.copyto(input_view, q, casting='unsafe')
+            elif waveform.dtype == np.int16:
+                # Scale to [-1, 1], cast to float32 and store in one pass
+                np.multiply(waveform, _INT16_RECIP, out=input_view)
+            else:
+                np.copyto(input_view, waveform, casting='same_kind')
+            del input_view
+
+            interpreter.invoke()
+
+            # Get output scores. get_tensor() already returns a copy, so the scores
+            # stay valid after the interpreter's next invoke().
+            scores = interpreter.get_tensor(OUTPUT_IDX)
 
-                # Get output scores; convert to a copy to avoid holding internal references
-                scores = np.copy(interpreter.get_tensor(output_details[0]['index']))  
+            if _int8_output:
+                scale, zero_point = yamcam_config.output_quantization
+                scores = (scores.astype(np.float32) - zero_point) * scale
 
             if scores.size == 0:
                 logger.warning(f"{camera_name}: No scores available to analyze.")
@@ -208,93 +332,94 @@ def analyze_audio_waveform(waveform, camera_name, interpreter, input_details, ou
      # -------- Calculate, Group, and Filter Scores  
 
 def rank_sounds(scores, camera_name):
-    if shutdown_event.is_set():
-        return []
 
     # Get config settings
-    default_min_score = yamcam_config.default_min_score
     top_k = yamcam_config.top_k
     noise_threshold = yamcam_config.noise_threshold
     class_names = yamcam_config.class_names
-    sounds_filters = yamcam_config.sounds_filters
-    sounds_to_track = yamcam_config.sounds_to_track
     log_everything = yamcam_config.log_everything
+    group_names = yamcam_config.group_names
+    class_group_name = yamcam_config.class_group_name
+    tracked_mask = yamcam_config.tracked_mask
+    tracked_group_mask = yamcam_config.tracked_group_mask
+    group_min_score = yamcam_config.group_min_score
 
     # Step 1: Filter scores based on noise threshold
-    filtered_scores = [
-        (i, score) for i, score in enumerate(scores[0]) if score >= noise_threshold
-    ]
-
-    # Track the number of classes that are not in sounds_to_track
-    not_tracked_count = 0
-
-    # Log each detected class, and count those not tracked
-    for i, score in filtered_scores:
-        class_name = class_names[i]
-        group = class_name.split('.')[0]  # Extract the group prefix
-
-        # Check if the group is in sounds_to_track
-        is_tracked = group in sounds_to_track
-        if not is_tracked:
-            not_tracked_count += 1  # Increment for untracked classes
-
-        # Log each class based on log_everything setting
-        if log_everything or is_tracked:
-            logger.debug(f"{camera_name}:--> {class_name}: {score:.2f}")
+    scores_row = scores[0]
+    kept_idx = np.flatnonzero(scores_row >= noise_threshold)
+
+    # Which of those belong to groups in sounds_to_track
+    tracked_hits = tracked_mask[kept_idx]
+
+    # Log each class based on log_everything setting (only tracked ones otherwise)
+    # (skip formatting the messages altogether unless they'll go somewhere)
+    is_debug = logger.isEnabledFor(logging.DEBUG)
+    if is_debug or sound_log_writer is not None:
+        csv_rows = []
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        log_idx = kept_idx if log_everything else kept_idx[tracked_hits]
+        for i in log_idx.tolist():
+            class_name = class_names[i]
+            score = scores_row[i]
+            if is_debug:
+                logger.debug(f"{camera_name}:--> {class_name}: {score:.2f}")
 
             # Log to CSV only for tracked groups or when log_everything is True
-            if (log_everything or is_tracked) and sound_log_writer is not None:
-                timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                row = [timestamp, camera_name, '', '', class_name, f"{score:.2f}", '', '']
-                with sound_log_lock:
-                    sound_log_writer.writerow(row)
-                    sound_log_file.flush()
+            if sound_log_writer is not None:
+                csv_rows.append([timestamp, camera_name, '', '', class_name,
+                                 f"{score:.2f}", '', ''])
 
-    # Report the number of found classes and those not tracked
-    logger.debug(f"{camera_name}: {len(filtered_scores)} classes found"
-                 f" ({not_tracked_count} not tracked)")
+        # One queue entry for the whole waveform
+        if csv_rows:
+            log_sound_rows(csv_rows)
 
-    if not filtered_scores:
+    # Report the number of found classes and those not tracked
+    if is_debug:
+        logger.debug(f"{camera_name}: {kept_idx.size} classes found"
+                     f" ({kept_idx.size - np.count_nonzero(tracked_hits)} not tracked)")
+
+    # Nothing more to do unless a class passed the filter, and (unless
+    # log_everything is set) at least one of them is tracked - the usual
+    # case for a quiet camera
+    if kept_idx.size == 0 or not (log_everything or tracked_hits.any()):
         return []
 
     # Step 2: Group scores by prefix if we are applying filters
     if not log_everything:
-        group_scores_dict = group_scores_by_prefix(filtered_scores, class_names)
-        composite_scores = calculate_composite_scores(group_scores_dict)
-        sorted_composite_scores = sorted(composite_scores, key=lambda x: x[1], reverse=True)
-        limited_composite_scores = sorted_composite_scores[:top_k]
+        count_per_group, max_per_group = group_scores_by_prefix(scores_row, kept_idx)
+        composite_scores = calculate_composite_scores(count_per_group, max_per_group)
+
+        # top_k of the groups that had a class pass the filter, best first
+        found = np.flatnonzero(count_per_group)
+        k = min(top_k, found.size)
+        top = found[np.argpartition(composite_scores[found], -k)[-k:]]
+        top = top[np.argsort(-composite_scores[top])]
 
         # Step 3: Apply min_score filters for tracked groups
-        results = []
-        for group, score in limited_composite_scores:
-            if group in sounds_to_track:
-                min_score = sounds_filters.get(group, {}).get('min_score', default_min_score)
-                if score >= min_score:
-                    results.append({'class': group, 'score': score})
+        top = top[tracked_group_mask[top] & (composite_scores[top] >= group_min_score[top])]
 
-        return results
+        return [{'class': group_names[group_id], 'score': float(composite_scores[group_id])}
+                for group_id in top.tolist()]
 
     # If log_everything is True, skip filtering and return all classes detected
-    return [{'class': class_names[i].split('.')[0], 'score': score} for i, score in filtered_scores]
+    return [{'class': class_group_name[i], 'score': scores_row[i]}
+            for i in kept_idx.tolist()]
 
 
 
      # -------- Combine filtered class/score Pairs into Groups  
-     # Group scores by prefix (e.g., 'music.*'), and keep track 
-     # of the individual class scores.
-def group_scores_by_prefix(filtered_scores, class_names):
-    group_scores_dict = {}
-
-    for i, score in filtered_scores:
-        class_name = class_names[i]
-        group = class_name.split('.')[0]  # Get the group prefix before the first period '.'
-
-        if group not in group_scores_dict:
-            group_scores_dict[group] = []
+     # Group scores by prefix (e.g., 'music.*'): for each group, count the classes
+     # that passed the noise filter (kept_idx) and take the highest of their scores.
+     # Only the kept classes are touched, not all 521.
+def group_scores_by_prefix(scores_row, kept_idx):
+    num_groups = yamcam_config.num_groups
+    group_ids = yamcam_config.class_group_id[kept_idx]
 
-        group_scores_dict[group].append(score)
+    max_per_group = np.zeros(num_groups, dtype=np.float32)
+    np.maximum.at(max_per_group, group_ids, scores_row[kept_idx])
+    count_per_group = np.bincount(group_ids, minlength=num_groups)
 
-    return group_scores_dict
+    return count_per_group, max_per_group
 
 
      # -------- Calculate Composite Scores for Groups 
@@ -303,78 +428,59 @@ def group_scores_by_prefix(filtered_scores, class_names):
      # - If max score in group is > 0.7, use this as the group composite score.
      # - Otherwise, boost score with credit based on number of group classes that were found:
      #   Max score + 0.05 * number of classes in the group (Cap Max score at 0.95).
-def calculate_composite_scores(group_scores_dict):
+def calculate_composite_scores(count_per_group, max_per_group):
 
-    composite_scores = []
-
-    for group, scores in group_scores_dict.items():
-        max_score = max(scores)
-        if max_score > 0.7:
-            composite_score = max_score
-        else:
-            composite_score = min(max_score + 0.05 * len(scores), 0.95)
-
-        composite_scores.append((group, composite_score))
-
-    return composite_scores
+    return np.where(max_per_group > 0.7, max_per_group,
+                    np.minimum(max_per_group + 0.05 * count_per_group, 0.95))
 
      # -------- Manage Sound Event Window 
 def update_sound_window(camera_name, detected_sounds):
 
-    if shutdown_event.is_set():
-        return
-
     current_time = time.time()
-    with state_lock:
-
-        # Initialize if not present
-        if camera_name not in sound_windows:
-            sound_windows[camera_name] = {}
-            active_sounds[camera_name] = {}
-            last_detection_time[camera_name] = {}
-            decay_counters[camera_name] = {}  # Initialize decay_counters for the camera
-            event_counts[camera_name] = {}    # Initialize event_counts for the camera
-
-        window = sound_windows[camera_name]
-        active = active_sounds[camera_name]
-        last_time = last_detection_time[camera_name]
-        decay_camera = decay_counters[camera_name]
-        counts = event_counts[camera_name]
-
-        for sound_class in yamcam_config.sounds_to_track:
-            # Initialize deque for sound class
-            if sound_class not in window:
-                window[sound_class] = deque(maxlen=yamcam_config.window_detect)
-
-            # Update detections
+
+    camera_lock = camera_locks.get(camera_name)
+    if camera_lock is None:
+        with state_lock:
+            # Initialize if not present
+            if camera_name not in camera_locks:
+                sound_state[camera_name] = {sound_class: SoundState()
+                                            for sound_class in yamcam_config.sounds_to_track}
+                camera_locks[camera_name] = Lock()  # last, once the state exists
+            camera_lock = camera_locks[camera_name]
+
+    window_bits = (1 << yamcam_config.window_detect) - 1
+    persistence = yamcam_config.persistence
+    decay = yamcam_config.decay
+
+    with camera_lock:
+        for sound_class, state in sound_state[camera_name].items():
+            # Update detections: shift the window, dropping the oldest waveform
             is_detected = sound_class in detected_sounds
-            window[sound_class].append(is_detected)
+            state.window = ((state.window << 1) | is_detected) & window_bits
 
             # Update last detection time
             if is_detected:
-                last_time[sound_class] = current_time
+                state.last_time = current_time
 
             # Check for start event
-            if window[sound_class].count(True) >= yamcam_config.persistence:
-                if not active.get(sound_class, False):
-                    active[sound_class] = True
-                    decay_camera[sound_class] = yamcam_config.decay
+            if state.window.bit_count() >= persistence:
+                if not state.active:
+                    state.active = True
+                    state.decay = decay
                     # Increment the event count for this sound_class
-                    counts[sound_class] = counts.get(sound_class, 0) + 1
+                    state.event_count += 1
                     report_event(camera_name, sound_class, 'start', current_time)
-                    if not shutdown_event.is_set():
-                        logger.debug(f"{camera_name}: Sound '{sound_class}' started.")
+                    logger.debug(f"{camera_name}: Sound '{sound_class}' started.")
             else:
                 # Check for stop event using decay counters
-                if active.get(sound_class, False):
-                    if sound_class in detected_sounds:
+                if state.active:
+                    if is_detected:
                         # Reset decay counter if sound is detected
-                        decay_camera[sound_class] = yamcam_config.decay
+                        state.decay = decay
                     else:
                         # Decrement decay counter if sound is not detected
-                        decay_camera[sound_class] -= 1
-                        if decay_camera[sound_class] <= 0:
-                            active[sound_class] = False
+                        state.decay -= 1
+                        if state.decay <= 0:
+                            state.active = False
                             report_event(camera_name, sound_class, 'stop', current_time)
-                            if not shutdown_event.is_set():
-                                logger.debug(f"{camera_name}: Sound '{sound_class}' stopped.")
+                            logger.debug(f"{camera_name}: Sound '{sound_class}' stopped.")
@@ -18,8 +18,9 @@
 # yamcam_supervisor.py
 
 import threading
-import time
-from camera_audio_stream import CameraAudioStream
+import sys
+from camera_audio_stream import CameraAudioStream, PyAVAudioStream, StreamMultiplexer
+import yamcam_config
 from yamcam_config import logger
 
 #                                              #
@@ -37,12 +38,21 @@ class CameraStreamSupervisor:
         self.lock = threading.Lock()
         self.running = True
         self.supervisor_thread = threading.Thread(target=self.monitor_streams, daemon=True)
+        # one thread services the FFmpeg pipes of every stream (not needed
+        # with the pyav backend, which decodes on a thread per stream)
+        if yamcam_config.audio_backend == 'ffmpeg':
+            self.multiplexer = StreamMultiplexer(shutdown_event)
+        else:
+            self.multiplexer = None
 
      # -------- START ALL STREAMS
     def start_all_streams(self):
         logger.debug("STARTING STREAMS")
         for camera_name, camera_config in self.camera_configs.items():
             self.start_stream(camera_name)
+        if self.multiplexer is not None:
+            self.multiplexer.start()
+            logger.debug("Stream multiplexer thread started.")
         self.supervisor_thread.start()
         logger.debug("Supervisor thread started.")
 
@@ -55,9 +65,15 @@ class CameraStreamSupervisor:
                 logger.debug(f"Starting stream for {camera_name}.")
                 # We assume the configuration is valid at this point
                 rtsp_url = camera_config['ffmpeg']['inputs'][0]['path']
-                stream = CameraAudioStream(camera_name, rtsp_url,
-                                           self.analyze_callback, buffer_size=31200,
-                                           shutdown_event=self.shutdown_event)
+                if yamcam_config.audio_backend == 'pyav':
+                    stream = PyAVAudioStream(camera_name, rtsp_url,
+                                             self.analyze_callback, buffer_size=31200,
+                                             shutdown_event=self.shutdown_event)
+                else:
+                    stream = CameraAudioStream(camera_name, rtsp_url,
+                                               self.analyze_callback, buffer_size=31200,
+                                               shutdown_event=self.shutdown_event,
+                                               multiplexer=self.multiplexer)
                 stream.start()
                 self.streams[camera_name] = stream
                 logger.debug(f"Started stream for {camera_name}.")
@@ -86,6 +102,12 @@ class CameraStreamSupervisor:
                     logger.error(f"Error stopping stream {stream.camera_name}: {e}", exc_info=True)
             logger.debug("All audio streams have been requested to stop.")
             logger.info("Cleaning up.")
+        if self.multiplexer is not None:
+            try:
+                self.multiplexer.join(timeout=5)
+                logger.debug("Stream multiplexer thread stopped.")
+            except Exception as e:
+                logger.error(f"Error stopping stream multiplexer thread: {e}", exc_info=True)
         try:
             self.supervisor_thread.join(timeout=5)  # Wait up to 5 seconds for supervisor_thread to finish
             logger.debug("Supervisor thread stopped.")
@@ -95,8 +117,9 @@ class CameraStreamSupervisor:
      # -------- MONITOR STREAMS
     def monitor_streams(self):
         logger.debug("Supervisor monitoring started.")
-        while self.running and not self.shutdown_event.is_set():
-            time.sleep(60)  # Sleep for 1 minute
+        while self.running:
+            if self.shutdown_event.wait(timeout=60):  # Check every minute
+                break
             with self.lock:
                 for camera_name in self.camera_configs.keys():
                     if self.shutdown_event.is_set():
@@ -0,0 +1,104 @@
+#
+# Yamcam Sound Profiler (YSP) - CeC
+#
+# yamnet_quantize.py - build files/yamnet_int8.tflite, an int8 version of YAMNet
+#
+#    The shipped files/yamnet.tflite is already converted (float32), so the
+#    int8 model is built from the original YAMNet SavedModel on TensorFlow Hub.
+#    Post-training quantization needs a representative dataset to calibrate
+#    activation ranges; it is taken from 16 kHz mono 16-bit WAV files, ideally
+#    recorded from your own microphones so the calibration matches what YSP hears.
+#    With --dynamic-range only the weights are quantized (activations, input and
+#    output stay float32), which needs no calibration audio.
+#
+#    Usage (one time, needs tensorflow-hub: pip install tensorflow-hub):
+#
+#        python yamnet_quantize.py <directory of .wav files>
+#        python yamnet_quantize.py --dynamic-range
+#
+#    then set model_quantized: true in microphones.yaml.
+#
+
+import os
+import sys
+import wave
+import argparse
+import numpy as np
+import tensorflow as tf
+import tensorflow_hub as hub
+
+YAMNET_HUB_URL = 'https://tfhub.dev/google/yamnet/1'
+output_path = './files/yamnet_int8.tflite'
+window_samples = 15600    # 0.975s at 16 kHz, same window YSP analyzes
+num_calibration = 100     # windows fed to the converter
+
+# -------- COLLECT CALIBRATION WINDOWS FROM WAV FILES
+
+def load_windows(wav_dir, max_windows):
+    windows = []
+    for name in sorted(os.listdir(wav_dir)):
+        if not name.lower().endswith('.wav'):
+            continue
+        path = os.path.join(wav_dir, name)
+        with wave.open(path, 'rb') as w:
+            if (w.getframerate() != 16000 or w.getnchannels() != 1
+                    or w.getsampwidth() != 2):
+                print(f"Skipping {path}: must be 16 kHz mono 16-bit PCM")
+                continue
+            pcm = np.frombuffer(w.readframes(w.getnframes()), dtype=np.int16)
+        waveform = pcm.astype(np.float32) / 32768.0
+        for start in range(0, len(waveform) - window_samples + 1, window_samples):
+            windows.append(waveform[start:start + window_samples])
+            if len(windows) >= max_windows:
+                return windows
+    return windows
+
+# -------- CONVERT
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an int8 YAMNet model for YSP.")
+    parser.add_argument('wav_dir', nargs='?',
+                        help="directory of 16 kHz mono WAV files for calibration")
+    parser.add_argument('--dynamic-range', action='store_true',
+                        help="quantize weights only; no calibration audio needed")
+    args = parser.parse_args()
+
+    if not args.dynamic_range:
+        if not args.wav_dir:
+            parser.error("wav_dir is required unless --dynamic-range is given")
+        windows = load_windows(args.wav_dir, num_calibration)
+        if not windows:
+            print(f"Error: no usable {window_samples}-sample windows found in {args.wav_dir}")
+            sys.exit(1)
+        print(f"INFO: Calibrating with {len(windows)} windows.")
+
+    yamnet = hub.load(YAMNET_HUB_URL)
+
+    # Same signature as files/yamnet.tflite: one [15600] waveform in,
+    # [1, 521] class scores out
+    @tf.function(input_signature=[tf.TensorSpec([window_samples], tf.float32)])
+    def classify(waveform):
+        scores, _, _ = yamnet(waveform)
+        return tf.reduce_mean(scores, axis=0, keepdims=True)
+
+    converter = tf.lite.TFLiteConverter.from_concrete_functions(
+        [classify.get_concrete_function()], yamnet)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    # Without a representative dataset the converter does dynamic-range quantization
+    if not args.dynamic_range:
+        def representative_dataset():
+            for waveform in windows:
+                yield [waveform]
+
+        converter.representative_dataset = representative_dataset
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+    print(f"INFO: Wrote {output_path}. Set model_quantized: true in microphones.yaml to use it.")
+
+
+if __name__ == '__main__':
+    main()